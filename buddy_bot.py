@@ -4,7 +4,7 @@ Buddy - Your Friendly Telegram Bot
 
 A Telegram bot with three modes:
 - /single: Batch messages and respond once after the window
-- /parallel: Start AI generation immediately, cancel if new messages arrive
+- /parallel: Start AI generation on every message, send the one covering the whole batch
 - /stitch: Only batch and echo back the stitched message
 
 Author: Anjaneya Sharma
@@ -12,12 +12,16 @@ Version: 1.0
 """
 
 import asyncio
+import hashlib
+import io
 import logging
 import os
+import sys
+import time
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Dict, List, Optional, Set
-from datetime import datetime
+from typing import Any, Coroutine, Dict, List, Optional, Set, Tuple
 
 from telegram import Update, Bot
 from telegram.ext import (
@@ -28,7 +32,7 @@ from telegram.ext import (
     filters
 )
 from telegram.constants import ChatAction
-from groq import Groq
+from groq import AsyncGroq
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -42,9 +46,31 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Configuration
-BATCH_WINDOW = 5.0  # seconds
+BATCH_WINDOW = 2.0  # seconds, used for batches longer than the steps below
+BATCH_WINDOW_STEPS = (  # (max total chars, window in seconds)
+    (320, 0.25),
+    (1024, 0.5),
+    (4096, 1.0),
+)
+MAX_BATCH_MESSAGES = 64  # a batch this big is flushed without waiting
+MAX_BATCH_CHARS = 100_000  # likewise, keeping prompts well inside the model's context window
+GROQ_MODEL = "llama-3.3-70b-versatile"
+GROQ_TEMPERATURE = 0.7
+RESPONSE_CACHE_SIZE = 1024  # entries
+RESPONSE_CACHE_TTL = 3600.0  # seconds
+MAX_USERS = 50_000  # least recently active users are forgotten beyond this
+USER_IDLE_TIMEOUT = 3600.0  # seconds before an idle user's state is dropped
+USER_SWEEP_INTERVAL = 300.0  # seconds between idle-user sweeps
+MAX_PARALLEL_GENERATIONS = 3  # concurrent AI calls per user in parallel mode
+TYPING_DEBOUNCE = 4.0  # seconds; Telegram clears the typing action after ~5s
+STREAM_FIRST_CHUNK = 24  # chars to collect before the first streamed message is sent
+STREAM_EDIT_INTERVAL = 0.8  # seconds between edits, under Telegram's ~1 edit/s limit
+STREAM_CURSOR = " ▌"  # shown at the end of a reply while it's still streaming
+MESSAGE_CHUNK_SIZE = 4000  # chars per message, safely under Telegram's 4096 limit
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # e.g. https://buddy.example.com; polling is used when unset
+PORT = int(os.getenv('PORT', '8443'))
 
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable is required")
@@ -59,15 +85,61 @@ class BotMode(Enum):
     STITCH = "stitch"
 
 
-@dataclass
+@dataclass(slots=True)
 class UserState:
     """State for each user"""
     mode: BotMode = BotMode.SINGLE
-    pending_messages: List[str] = field(default_factory=list)
+    pending_buffer: io.StringIO = field(default_factory=io.StringIO)
+    pending_count: int = 0
     timer_task: Optional[asyncio.Task] = None
-    ai_task: Optional[asyncio.Task] = None
-    last_activity: datetime = field(default_factory=datetime.now)
-    prepared_response: Optional[str] = None
+    ai_tasks: Dict[int, asyncio.Task] = field(default_factory=dict)  # keyed by pending_count
+    reply_tasks: Set[asyncio.Task] = field(default_factory=set)  # replies to committed batches
+    last_activity: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # guards the fields above
+    
+    def add_message(self, message_text: str) -> None:
+        """Append a message to the pending batch"""
+        if self.pending_count:
+            self.pending_buffer.write(" ")
+        self.pending_buffer.write(message_text)
+        self.pending_count += 1
+        
+    def stitched_message(self) -> str:
+        """Return all pending messages joined with spaces"""
+        return self.pending_buffer.getvalue()
+        
+    def pending_length(self) -> int:
+        """Return the number of characters in the stitched batch"""
+        return self.pending_buffer.tell()
+        
+    def clear_pending(self) -> None:
+        """Drop all pending messages"""
+        self.pending_buffer = io.StringIO()
+        self.pending_count = 0
+
+
+def _split_for_telegram(text: str, limit: int = MESSAGE_CHUNK_SIZE) -> List[str]:
+    """Split text into message-sized chunks, preferring paragraph, then line or sentence breaks"""
+    chunks = []
+    text = text.strip()
+    while len(text) > limit:
+        window = text[:limit]
+        cut = window.rfind("\n\n")
+        if cut <= 0:
+            cut = max(window.rfind("\n"), window.rfind(". ")) + 1
+        if cut <= 0:
+            cut = window.rfind(" ")
+        if cut <= 0:
+            cut = limit
+            
+        chunk = text[:cut].rstrip()
+        if chunk:
+            chunks.append(chunk)
+        text = text[cut:].lstrip()
+        
+    if text:
+        chunks.append(text)
+    return chunks
 
 
 class BuddyBot:
@@ -77,63 +149,76 @@ class BuddyBot:
     Handles three different message processing modes with per-user state management.
     """
     
+    # Friend-like prompt for Buddy
+    _SYSTEM_MSG = {
+        "role": "system",
+        "content": (
+            "You are Buddy, a friendly and casual chat companion. "
+            "You're helpful, empathetic, and speak like a good friend would - "
+            "warm, supportive, and conversational. Keep responses natural and engaging. "
+            "You can use emojis when appropriate to add friendliness. "
+            "Be concise but thoughtful in your responses."
+        ),
+    }
+    
+    _WELCOME_MESSAGE = (
+        "👋 Hey there! I'm Buddy, your friendly chat companion!\n\n"
+        "I have three different modes to chat with you:\n\n"
+        "🔸 `/single` - I'll wait for a short pause in your messages, "
+        "then give you one thoughtful response\n\n"
+        "🔸 `/parallel` - I start thinking as soon as you message me, and if you "
+        "send more messages, I'll begin a fresh reply with everything combined\n\n"
+        "🔸 `/stitch` - I just repeat back what you said (great for testing!)\n\n"
+        "Currently in **single** mode. What's on your mind? 😊"
+    )
+    
+    _MODE_DESCRIPTIONS = {
+        BotMode.SINGLE: "I'll batch your messages and respond once after the window closes! 📦",
+        BotMode.PARALLEL: "I'll start working immediately and begin a fresh reply with everything combined if you send more messages! ⚡",
+        BotMode.STITCH: "I'll just echo back your combined messages! 🔁"
+    }
+    
     def __init__(self):
-        self.groq_client = Groq(api_key=GROQ_API_KEY)
-        self.user_states: Dict[int, UserState] = {}
-        self.typing_users: Set[int] = set()
+        self.groq_client = AsyncGroq(api_key=GROQ_API_KEY)
+        self._response_cache: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+        self.user_states: OrderedDict[int, UserState] = OrderedDict()  # least recently active first
+        self._sweeper_task: Optional[asyncio.Task] = None
+        self._reply_tasks: Set[asyncio.Task] = set()  # every user's reply tasks, for shutdown
+        self.typing_last_sent: Dict[int, float] = {}
         
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /start command"""
         user_id = update.effective_user.id
-        self.user_states[user_id] = UserState()
-        
-        welcome_message = (
-            "👋 Hey there! I'm Buddy, your friendly chat companion!\n\n"
-            "I have three different modes to chat with you:\n\n"
-            "🔸 `/single` - I'll wait for all your messages in a 5-second window, "
-            "then give you one thoughtful response\n\n"
-            "🔸 `/parallel` - I start thinking as soon as you message me, but if you "
-            "send more messages, I'll restart with everything combined\n\n"
-            "🔸 `/stitch` - I just repeat back what you said (great for testing!)\n\n"
-            "Currently in **single** mode. What's on your mind? 😊"
-        )
+        user_state = await self._get_user_state(user_id)
+        
+        # Start over in single mode, reusing the state so its lock stays valid
+        async with user_state.lock:
+            await self._cancel_user_operations(user_id)
+            user_state.mode = BotMode.SINGLE
         
-        await update.message.reply_text(welcome_message, parse_mode='Markdown')
+        await update.message.reply_text(self._WELCOME_MESSAGE, parse_mode='Markdown')
         
     async def mode_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, mode: BotMode) -> None:
         """Handle mode switching commands"""
         user_id = update.effective_user.id
+        user_state = await self._get_user_state(user_id)
         
-        if user_id not in self.user_states:
-            self.user_states[user_id] = UserState()
+        async with user_state.lock:
+            # Cancel any pending operations
+            await self._cancel_user_operations(user_id)
             
-        # Cancel any pending operations
-        await self._cancel_user_operations(user_id)
-        
-        self.user_states[user_id].mode = mode
-        
-        mode_descriptions = {
-            BotMode.SINGLE: "I'll batch your messages and respond once after the window closes! 📦",
-            BotMode.PARALLEL: "I'll start working immediately but restart if you send more messages! ⚡",
-            BotMode.STITCH: "I'll just echo back your combined messages! 🔁"
-        }
+            user_state.mode = mode
         
         await update.message.reply_text(
-            f"Switched to **{mode.value}** mode! {mode_descriptions[mode]}",
+            f"Switched to **{mode.value}** mode! {self._MODE_DESCRIPTIONS[mode]}",
             parse_mode='Markdown'
         )
         
-    async def single_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle /single command"""
-        await self.mode_command(update, context, BotMode.SINGLE)
-        
-    async def parallel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle /parallel command"""
-        await self.mode_command(update, context, BotMode.PARALLEL)
-        
-    async def stitch_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Handle /stitch command"""
-        await self.mode_command(update, context, BotMode.STITCH)
+    async def mode_dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /single, /parallel and /stitch commands"""
+        # "/Parallel@BuddyBot extra" -> "parallel"
+        command = update.message.text.split()[0].lstrip("/").split("@")[0].lower()
+        await self.mode_command(update, context, BotMode(command))
         
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle incoming text messages"""
@@ -141,28 +226,62 @@ class BuddyBot:
         message_text = update.message.text
         
         # Initialize user state if needed
-        if user_id not in self.user_states:
-            self.user_states[user_id] = UserState()
-            
-        user_state = self.user_states[user_id]
-        user_state.last_activity = datetime.now()
-        user_state.pending_messages.append(message_text)
+        user_state = await self._get_user_state(user_id)
         
-        logger.info(f"User {user_id} ({user_state.mode.value} mode): {message_text}")
-        
-        if user_state.mode == BotMode.SINGLE:
-            await self._handle_single_mode(update, context, user_id)
-        elif user_state.mode == BotMode.PARALLEL:
-            await self._handle_parallel_mode(update, context, user_id)
-        elif user_state.mode == BotMode.STITCH:
-            await self._handle_stitch_mode(update, context, user_id)
+        # Serialize updates from the same user so batch state can't interleave
+        async with user_state.lock:
+            user_state.last_activity = time.monotonic()
+            user_state.add_message(message_text)
+            
+            logger.info(f"User {user_id} ({user_state.mode.value} mode): {message_text}")
+            
+            if user_state.mode == BotMode.SINGLE:
+                await self._handle_single_mode(update, context, user_id)
+            elif user_state.mode == BotMode.PARALLEL:
+                await self._handle_parallel_mode(update, context, user_id)
+            elif user_state.mode == BotMode.STITCH:
+                await self._handle_stitch_mode(update, context, user_id)
             
+    async def _get_user_state(self, user_id: int) -> UserState:
+        """Fetch (or create) a user's state and mark it as most recently active"""
+        if user_id not in self.user_states:
+            self.user_states[user_id] = UserState()
+        self.user_states.move_to_end(user_id)
+        
+        # Forget the least recently active users once we're over capacity
+        while len(self.user_states) > MAX_USERS:
+            evicted_id = next(iter(self.user_states))
+            await self._cancel_user_operations(evicted_id)
+            del self.user_states[evicted_id]
+            self.typing_last_sent.pop(evicted_id, None)
+            
+        return self.user_states[user_id]
+        
+    async def _sweep_idle_users(self) -> None:
+        """Periodically drop state for users who have gone quiet"""
+        while True:
+            await asyncio.sleep(USER_SWEEP_INTERVAL)
+            
+            now = time.monotonic()
+            idle_ids = [
+                user_id for user_id, user_state in self.user_states.items()
+                if now - user_state.last_activity > USER_IDLE_TIMEOUT and not user_state.pending_count
+            ]
+            
+            for user_id in idle_ids:
+                await self._cancel_user_operations(user_id)
+                self.user_states.pop(user_id, None)
+                self.typing_last_sent.pop(user_id, None)
+                
+            if idle_ids:
+                logger.info(f"Dropped state for {len(idle_ids)} idle users")
+                
     async def _handle_single_mode(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
         """Handle message in single mode"""
         user_state = self.user_states[user_id]
         
         # Start typing indicator immediately when first message arrives
-        if len(user_state.pending_messages) == 1:
+        if user_state.pending_count == 1:
             await self._start_typing(context.bot, update.effective_chat.id)
         
         # Cancel existing timer if any
@@ -179,22 +298,24 @@ class BuddyBot:
         user_state = self.user_states[user_id]
         
         # Start typing indicator immediately when first message arrives
-        if len(user_state.pending_messages) == 1:
+        if user_state.pending_count == 1:
             await self._start_typing(context.bot, update.effective_chat.id)
         
-        # Cancel existing AI task if running
-        if user_state.ai_task and not user_state.ai_task.done():
-            user_state.ai_task.cancel()
-            
         # Cancel existing timer if any
         if user_state.timer_task and not user_state.timer_task.done():
             user_state.timer_task.cancel()
             
-        # Start AI generation immediately
-        user_state.ai_task = asyncio.create_task(
-            self._generate_ai_response(update, context, user_id, wait_for_batch=True)
+        # Start AI generation immediately on everything received so far,
+        # leaving earlier generations running alongside it
+        user_state.ai_tasks[user_state.pending_count] = asyncio.create_task(
+            self._request_ai_response(user_state.stitched_message())
         )
         
+        # Keep the number of in-flight generations bounded, dropping the stalest
+        while len(user_state.ai_tasks) > MAX_PARALLEL_GENERATIONS:
+            oldest = next(iter(user_state.ai_tasks))
+            self._discard_task(user_state.ai_tasks.pop(oldest))
+        
         # Start timer for potential new messages
         user_state.timer_task = asyncio.create_task(
             self._batch_timer(update, context, user_id)
@@ -205,7 +326,7 @@ class BuddyBot:
         user_state = self.user_states[user_id]
         
         # Start typing indicator immediately when first message arrives
-        if len(user_state.pending_messages) == 1:
+        if user_state.pending_count == 1:
             await self._start_typing(context.bot, update.effective_chat.id)
         
         # Cancel existing timer if any
@@ -220,165 +341,282 @@ class BuddyBot:
     async def _batch_timer(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
         """Timer for batching window"""
         try:
-            await asyncio.sleep(BATCH_WINDOW)
-            
             user_state = self.user_states[user_id]
             
+            await asyncio.sleep(self._adaptive_window(user_state))
+            
+            if not user_state.pending_count:
+                return
+                
+            stitched_message = user_state.stitched_message()
             if user_state.mode == BotMode.SINGLE:
-                await self._generate_ai_response(update, context, user_id)
+                reply = self._generate_ai_response(update, context, user_id, stitched_message)
             elif user_state.mode == BotMode.PARALLEL:
-                # In parallel mode, AI task should already be running or completed
-                if user_state.ai_task and not user_state.ai_task.done():
-                    # Wait for AI task to complete
-                    await user_state.ai_task
+                # Only the generation that saw every pending message is worth sending
+                ai_task = user_state.ai_tasks.pop(user_state.pending_count, None)
+                self._cancel_ai_tasks(user_state)
+                reply = self._send_prepared_response(update, context, user_id, ai_task)
+            else:
+                reply = self._send_stitched_response(update, context, user_id, stitched_message)
                 
-                # Send the prepared response after batch window
-                await self._send_prepared_response(update, context, user_id)
-            elif user_state.mode == BotMode.STITCH:
-                await self._send_stitched_response(update, context, user_id)
+            # Single mode, and any mode once the batch is full, commits the batch
+            # before replying: later messages start a new batch instead of
+            # cancelling the reply and piling onto this one
+            if user_state.mode == BotMode.SINGLE or self._batch_full(user_state):
+                user_state.clear_pending()
+                self._start_reply(user_state, reply)
+            else:
+                await reply
+                user_state.clear_pending()
                 
         except asyncio.CancelledError:
             logger.debug(f"Batch timer cancelled for user {user_id}")
             
-    async def _generate_ai_response(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, wait_for_batch: bool = False) -> None:
-        """Generate AI response using Groq"""
-        user_state = self.user_states[user_id]
+    def _start_reply(self, user_state: UserState, reply: Coroutine[Any, Any, None]) -> None:
+        """Run a reply to a committed batch in its own task, tracked per user and bot-wide"""
+        reply_task = asyncio.create_task(reply)
+        for reply_tasks in (user_state.reply_tasks, self._reply_tasks):
+            reply_tasks.add(reply_task)
+            reply_task.add_done_callback(reply_tasks.discard)
+            
+    def _batch_full(self, user_state: UserState) -> bool:
+        """Check whether a user's pending batch has reached the size cap"""
+        return (
+            user_state.pending_count >= MAX_BATCH_MESSAGES
+            or user_state.pending_length() >= MAX_BATCH_CHARS
+        )
         
-        if not user_state.pending_messages:
-            return
+    def _adaptive_window(self, user_state: UserState) -> float:
+        """Pick the batching window for a user's pending batch"""
+        # Don't let a full batch grow any further
+        if self._batch_full(user_state):
+            return 0.0
             
+        total_chars = user_state.pending_length()
+        for max_chars, window in BATCH_WINDOW_STEPS:
+            if total_chars <= max_chars:
+                return window
+        return BATCH_WINDOW
+        
+    async def _generate_ai_response(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, stitched_message: str) -> None:
+        """Generate AI response using Groq"""
         try:
-            # Typing indicator already started when first message arrived
-            # Just ensure it's still active
-            await self._start_typing(context.bot, update.effective_chat.id)
-            
-            # Stitch messages together
-            stitched_message = " ".join(user_state.pending_messages)
-            
-            # Create friend-like prompt for Buddy
-            system_prompt = (
-                "You are Buddy, a friendly and casual chat companion. "
-                "You're helpful, empathetic, and speak like a good friend would - "
-                "warm, supportive, and conversational. Keep responses natural and engaging. "
-                "You can use emojis when appropriate to add friendliness. "
-                "Be concise but thoughtful in your responses."
-            )
-            
-            # Call Groq API
-            response = self.groq_client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": stitched_message}
-                ],
-                max_tokens=1000,
-                temperature=0.7,
-            )
-            
-            ai_response = response.choices[0].message.content
-            
-            # In parallel mode, store the response but don't send yet if we need to wait
-            if wait_for_batch:
-                user_state.prepared_response = ai_response
-                return
-            
-            # Stop typing indicator
-            await self._stop_typing(user_id)
-            
-            # Send response
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=ai_response
-            )
-            
-            # Clear pending messages
-            user_state.pending_messages.clear()
+            # Stream the response into the chat as it's generated
+            await self._stream_ai_response(context.bot, update.effective_chat.id, stitched_message)
             
         except asyncio.CancelledError:
-            await self._stop_typing(user_id)
             logger.debug(f"AI generation cancelled for user {user_id}")
         except Exception as e:
-            await self._stop_typing(user_id)
             logger.error(f"Error generating AI response for user {user_id}: {e}")
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text="Oops! I had a hiccup there. Could you try again? 😅"
             )
-            user_state.pending_messages.clear()
+            self.typing_last_sent.pop(update.effective_chat.id, None)
+            
+    def _ai_messages(self, stitched_message: str) -> list:
+        """Build the Groq chat messages for a stitched message"""
+        return [self._SYSTEM_MSG, {"role": "user", "content": stitched_message}]
+        
+    async def _request_ai_response(self, stitched_message: str) -> str:
+        """Get Buddy's reply to a stitched message from Groq"""
+        # Reuse a recent answer if we've seen this exact prompt before
+        cache_key = self._response_cache_key(stitched_message)
+        ai_response = self._get_cached_response(cache_key)
+        if ai_response is not None:
+            return ai_response
+            
+        # Call Groq API (async client, so other users aren't blocked)
+        response = await self.groq_client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=self._ai_messages(stitched_message),
+            max_tokens=1000,
+            temperature=GROQ_TEMPERATURE,
+        )
+        
+        ai_response = response.choices[0].message.content
+        if not ai_response or not ai_response.strip():
+            raise ValueError("Groq returned an empty response")
             
-    async def _send_stitched_response(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
-        """Send stitched message response"""
-        user_state = self.user_states[user_id]
+        self._store_cached_response(cache_key, ai_response)
+        return ai_response
         
-        if not user_state.pending_messages:
-            return
+    async def _stream_ai_response(self, bot: Bot, chat_id: int, stitched_message: str) -> str:
+        """Stream Buddy's reply into the chat, editing one message as tokens arrive"""
+        cache_key = self._response_cache_key(stitched_message)
+        ai_response = self._get_cached_response(cache_key)
+        if ai_response is not None:
+            await self._send_text(bot, chat_id, ai_response)
+            return ai_response
             
+        ai_response = ""
+        message = None
+        last_edit = 0.0
+        
+        # The typing indicator started with the first message; keep it up if
+        # the first words take longer than Telegram shows it for
+        renew_typing = asyncio.create_task(self._renew_typing(bot, chat_id))
         try:
-            # Typing indicator already started when first message arrived
-            # Just ensure it's still active
-            await self._start_typing(context.bot, update.effective_chat.id)
+            stream = await self.groq_client.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=self._ai_messages(stitched_message),
+                max_tokens=1000,
+                temperature=GROQ_TEMPERATURE,
+                stream=True,
+            )
             
+            # Close the stream even if sending fails part-way, freeing its connection
+            async with stream:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    ai_response += delta
+                
+                    # Send the first few words as soon as we have them, then keep
+                    # editing that message at a rate Telegram won't throttle
+                    if message is None:
+                        if len(ai_response) >= STREAM_FIRST_CHUNK:
+                            renew_typing.cancel()
+                            message = await bot.send_message(chat_id=chat_id, text=ai_response + STREAM_CURSOR)
+                            self.typing_last_sent.pop(chat_id, None)
+                            last_edit = time.monotonic()
+                    elif (
+                        time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL
+                        and len(ai_response) + len(STREAM_CURSOR) <= MESSAGE_CHUNK_SIZE
+                    ):
+                        await bot.edit_message_text(
+                            ai_response + STREAM_CURSOR, chat_id=chat_id, message_id=message.message_id
+                        )
+                        last_edit = time.monotonic()
+                    
+            if not ai_response.strip():
+                raise ValueError("Groq returned an empty response")
+                
+            # Send or finalize the full reply without the cursor, continuing in
+            # follow-up messages if it outgrew a single one
+            if message is None:
+                await self._send_text(bot, chat_id, ai_response)
+            else:
+                first_chunk, *rest = _split_for_telegram(ai_response)
+                await bot.edit_message_text(first_chunk, chat_id=chat_id, message_id=message.message_id)
+                for chunk in rest:
+                    await bot.send_message(chat_id=chat_id, text=chunk)
+        except (Exception, asyncio.CancelledError):
+            # Don't leave a half-finished reply behind
+            if message is not None:
+                try:
+                    await bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+                except Exception as e:
+                    logger.error(f"Error deleting partial response: {e}")
+            raise
+        finally:
+            renew_typing.cancel()
+            
+        self._store_cached_response(cache_key, ai_response)
+        return ai_response
+        
+    async def _send_stitched_response(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, stitched_message: str) -> None:
+        """Send stitched message response"""
+        try:
             # Brief delay to simulate processing
             await asyncio.sleep(1)
             
-            # Stitch messages together
-            stitched_message = " ".join(user_state.pending_messages)
-            
-            # Stop typing indicator
-            await self._stop_typing(user_id)
-            
             # Send stitched response
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=f"You said: {stitched_message}"
-            )
-            
-            # Clear pending messages
-            user_state.pending_messages.clear()
+            await self._send_text(context.bot, update.effective_chat.id, f"You said: {stitched_message}")
             
         except Exception as e:
-            await self._stop_typing(user_id)
             logger.error(f"Error sending stitched response for user {user_id}: {e}")
             
-    async def _send_prepared_response(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+    async def _send_prepared_response(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, ai_task: Optional[asyncio.Task]) -> None:
         """Send prepared AI response in parallel mode"""
-        user_state = self.user_states[user_id]
-        
-        if not user_state.prepared_response:
+        if ai_task is None:
             return
             
         try:
-            # Stop typing indicator
-            await self._stop_typing(user_id)
+            # Wait for the generation to finish if it's still running
+            ai_response = await ai_task
             
             # Send the prepared response
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=user_state.prepared_response
-            )
-            
-            # Clear pending messages and prepared response
-            user_state.pending_messages.clear()
-            user_state.prepared_response = None
+            await self._send_text(context.bot, update.effective_chat.id, ai_response)
             
         except Exception as e:
-            await self._stop_typing(user_id)
             logger.error(f"Error sending prepared response for user {user_id}: {e}")
-            
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text="Oops! I had a hiccup there. Could you try again? 😅"
+            )
+            self.typing_last_sent.pop(update.effective_chat.id, None)
+            
+    async def _send_text(self, bot: Bot, chat_id: int, text: str) -> None:
+        """Send text, split across as many messages as Telegram needs"""
+        # Sent one after another so the parts arrive in order
+        for chunk in _split_for_telegram(text):
+            await bot.send_message(chat_id=chat_id, text=chunk)
+            
+        # Sending a message clears the typing indicator, so the next batch needs a fresh one
+        self.typing_last_sent.pop(chat_id, None)
+            
+    def _cancel_ai_tasks(self, user_state: UserState) -> None:
+        """Cancel and forget all in-flight AI generations for a user"""
+        for task in user_state.ai_tasks.values():
+            self._discard_task(task)
+        user_state.ai_tasks.clear()
+        
+    @staticmethod
+    def _discard_task(task: asyncio.Task) -> None:
+        """Cancel a task, or consume its result if it already finished"""
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()
+            
+    def _response_cache_key(self, stitched_message: str) -> str:
+        """Build the cache key for a stitched prompt"""
+        raw = f"{GROQ_MODEL}|{GROQ_TEMPERATURE}|{stitched_message}"
+        return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+        
+    def _get_cached_response(self, key: str) -> Optional[str]:
+        """Return a cached AI response if it exists and hasn't expired"""
+        entry = self._response_cache.get(key)
+        if entry is None:
+            return None
+            
+        stored_at, ai_response = entry
+        if time.monotonic() - stored_at > RESPONSE_CACHE_TTL:
+            del self._response_cache[key]
+            return None
+            
+        self._response_cache.move_to_end(key)
+        return ai_response
+        
+    def _store_cached_response(self, key: str, ai_response: str) -> None:
+        """Store an AI response, evicting the least recently used entry when full"""
+        self._response_cache[key] = (time.monotonic(), ai_response)
+        self._response_cache.move_to_end(key)
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+            
+    async def _renew_typing(self, bot: Bot, chat_id: int) -> None:
+        """Re-send the typing indicator once, just before Telegram clears it"""
+        await asyncio.sleep(TYPING_DEBOUNCE)
+        await self._start_typing(bot, chat_id)
+        
     async def _start_typing(self, bot: Bot, chat_id: int) -> None:
         """Start typing indicator"""
         user_id = chat_id  # Assuming chat_id is user_id for private chats
-        if user_id not in self.typing_users:
-            self.typing_users.add(user_id)
-            try:
-                await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
-            except Exception as e:
-                logger.error(f"Error starting typing indicator: {e}")
-                
-    async def _stop_typing(self, user_id: int) -> None:
-        """Stop typing indicator"""
-        self.typing_users.discard(user_id)
         
+        # Skip the request if the previous indicator is still showing
+        now = time.monotonic()
+        if now - self.typing_last_sent.get(user_id, 0.0) < TYPING_DEBOUNCE:
+            return
+            
+        self.typing_last_sent[user_id] = now
+        try:
+            await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+        except Exception as e:
+            logger.error(f"Error starting typing indicator: {e}")
+                
     async def _cancel_user_operations(self, user_id: int) -> None:
         """Cancel all pending operations for a user"""
         if user_id not in self.user_states:
@@ -390,17 +628,25 @@ class BuddyBot:
         if user_state.timer_task and not user_state.timer_task.done():
             user_state.timer_task.cancel()
             
-        # Cancel AI task
-        if user_state.ai_task and not user_state.ai_task.done():
-            user_state.ai_task.cancel()
+        # Cancel AI tasks and any reply still being sent
+        self._cancel_ai_tasks(user_state)
+        for reply_task in list(user_state.reply_tasks):
+            reply_task.cancel()
             
-        # Stop typing
-        await self._stop_typing(user_id)
+        # Clear pending messages
+        user_state.clear_pending()
         
-        # Clear pending messages and prepared response
-        user_state.pending_messages.clear()
-        user_state.prepared_response = None
+    async def post_init(self, application: Application) -> None:
+        """Start background housekeeping once the application is initialized"""
+        self._sweeper_task = asyncio.create_task(self._sweep_idle_users())
         
+    async def post_stop(self, application: Application) -> None:
+        """Stop background housekeeping and any replies still streaming"""
+        if self._sweeper_task and not self._sweeper_task.done():
+            self._sweeper_task.cancel()
+        for reply_task in list(self._reply_tasks):
+            reply_task.cancel()
+            
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle errors"""
         logger.error(f"Exception while handling an update: {context.error}")
@@ -408,17 +654,36 @@ class BuddyBot:
 
 def main():
     """Main function to run the bot"""
+    # Use the libuv-based event loop where it's available (it doesn't support Windows)
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            logger.info("uvloop not installed, using the default asyncio event loop")
+    
     # Create bot instance
     buddy = BuddyBot()
     
-    # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Create application with a connection pool sized for many concurrent users,
+    # multiplexing requests over HTTP/2 keep-alive connections
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .http_version("2")
+        .connection_pool_size(256)
+        .pool_timeout(30.0)
+        .connect_timeout(10.0)
+        .read_timeout(30.0)
+        .get_updates_connection_pool_size(8)
+        .post_init(buddy.post_init)
+        .post_stop(buddy.post_stop)
+        .build()
+    )
     
     # Add handlers
     application.add_handler(CommandHandler("start", buddy.start_command))
-    application.add_handler(CommandHandler("single", buddy.single_command))
-    application.add_handler(CommandHandler("parallel", buddy.parallel_command))
-    application.add_handler(CommandHandler("stitch", buddy.stitch_command))
+    application.add_handler(CommandHandler([mode.value for mode in BotMode], buddy.mode_dispatch))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, buddy.handle_message))
     
     # Add error handler
@@ -426,7 +691,16 @@ def main():
     
     # Start the bot
     logger.info("Starting Buddy bot...")
-    application.run_polling()
+    if WEBHOOK_URL:
+        # Let Telegram push updates to us instead of polling getUpdates
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=TELEGRAM_BOT_TOKEN,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{TELEGRAM_BOT_TOKEN}",
+        )
+    else:
+        application.run_polling()
 
 
 if __name__ == '__main__':
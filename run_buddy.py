@@ -4,10 +4,8 @@ Buddy Bot Launcher
 Simplified script to start and manage the Buddy bot
 """
 
-import os
+import asyncio
 import sys
-import subprocess
-from pathlib import Path
 
 
 def run_bot():
@@ -18,19 +16,28 @@ def run_bot():
     print("-" * 40)
     
     try:
-        # Get the Python executable path
-        python_exe = Path("C:/Users/ANJANEYA/Desktop/Projects/telegram buddy/.venv/Scripts/python.exe")
-        if not python_exe.exists():
-            python_exe = "python"  # Fallback to system Python
-            
-        # Run the bot
-        subprocess.run([str(python_exe), "buddy_bot.py"], cwd=Path(__file__).parent)
+        # Run the bot in this process rather than spawning a new interpreter
+        from buddy_bot import main as bot_main
+        bot_main()
         
     except KeyboardInterrupt:
         print("\n\n👋 Buddy bot stopped. See you later!")
     except Exception as e:
         print(f"\n❌ Error running bot: {e}")
 
+def run_tests():
+    """Run the Buddy test script"""
+    try:
+        import test_buddy
+    except ModuleNotFoundError as e:
+        # Only a missing test_buddy itself; anything it fails to import should surface
+        if e.name != "test_buddy":
+            raise
+        print("\n❌ test_buddy.py not found")
+        return
+        
+    asyncio.run(test_buddy.main())
+
 def main():
     """Main launcher function"""
     print("🤖 Buddy Bot Launcher")
@@ -38,10 +45,7 @@ def main():
     
     if len(sys.argv) > 1 and sys.argv[1] == "test":
         # Run tests
-        python_exe = Path("C:/Users/ANJANEYA/Desktop/Projects/telegram buddy/.venv/Scripts/python.exe")
-        if not python_exe.exists():
-            python_exe = "python"
-        subprocess.run([str(python_exe), "test_buddy.py"])
+        run_tests()
     else:
         # Run the bot
         run_bot()